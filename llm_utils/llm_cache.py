@@ -0,0 +1,198 @@
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Protocol
+
+
+# temperature 高于此值时输出不确定，不做缓存
+MAX_CACHEABLE_TEMPERATURE = 0.2
+
+
+class CacheKey(NamedTuple):
+    """
+    一次请求的缓存键。
+
+    key: 完整请求（含用户输入）的摘要，用于精确匹配。
+    scope: 除用户输入外其余请求内容的摘要；语义匹配只在同一 scope 内进行。
+    """
+    key: str
+    scope: str
+
+
+def _digest(payload: dict) -> str:
+    """对 payload 做稳定的 JSON 序列化后计算 SHA-256"""
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_prefix_digest(model_name: str, system_prompt: str, base_url: str = None) -> str:
+    """
+    计算模型名、接口地址与系统提示词的摘要。三者在同一客户端的多次调用间不变，
+    只需在系统提示词变化时重新计算一次。
+    """
+    return _digest({"model": model_name, "system": system_prompt, "base_url": base_url})
+
+
+def make_cache_key(prefix_digest: str, user_prompt: str, request_kwargs: dict) -> CacheKey:
+    """
+    根据请求内容生成缓存键（SHA-256）。
+
+    参数:
+        prefix_digest (str): make_prefix_digest 的结果。
+        user_prompt (str): 用户输入。
+        request_kwargs (dict): 传给 API 的全部其他参数（temperature、max_tokens、
+            reasoning_effort、response_format 等），任何一项不同都视为不同请求。
+
+    返回:
+        CacheKey: 精确匹配键与语义匹配范围。
+    """
+    scope = _digest({"prefix": prefix_digest, "kwargs": request_kwargs})
+    return CacheKey(_digest({"scope": scope, "user": user_prompt}), scope)
+
+
+def is_cacheable(kwargs: dict) -> bool:
+    """只有显式指定了低 temperature 的（近似）确定性调用才走缓存"""
+    temperature = kwargs.get("temperature")
+    if temperature is None or kwargs.get("stream"):
+        return False
+    return temperature <= MAX_CACHEABLE_TEMPERATURE
+
+
+class CacheBackend(Protocol):
+    """缓存后端需要实现的接口"""
+
+    def get(self, key: str, user_prompt: str = None, scope: str = None) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str, user_prompt: str = None, scope: str = None) -> None:
+        ...
+
+
+class MemoryCache:
+    """
+    进程内 LRU 缓存。
+
+    使用示例:
+        # client = LLMClient(cache=MemoryCache(maxsize=1024))
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, user_prompt: str = None, scope: str = None) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, user_prompt: str = None, scope: str = None) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SqliteCache:
+    """
+    基于 sqlite 的磁盘缓存，重复运行同一批文件时可直接命中。
+
+    使用示例:
+        # client = LLMClient(cache=SqliteCache("llm_cache.sqlite3"))
+    """
+    def __init__(self, path: str = "llm_cache.sqlite3"):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, user_prompt: str = None, scope: str = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, user_prompt: str = None, scope: str = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, value)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticCache:
+    """
+    在精确缓存之上增加语义匹配：精确未命中时，用本地 sentence-transformers 模型
+    对用户输入做向量化，与同一请求范围（模型、系统提示词、请求参数均相同）内
+    历史输入的余弦相似度超过阈值则直接复用结果。
+
+    需要额外安装: pip install sentence-transformers numpy
+
+    限制: 向量模型只读取输入的前 max_seq_length 个 token（all-MiniLM-L6-v2 约 256），
+    开头相同、后文不同的两篇长文档会得到几乎一样的向量。因此超过该长度的输入
+    只做精确匹配，不参与语义匹配；它更适合短小、重复度高的输入。
+
+    参数:
+        backend (CacheBackend): 精确匹配使用的底层缓存。
+        model_name (str): sentence-transformers 模型名称。
+        threshold (float): 余弦相似度阈值，默认 0.92。
+    """
+    def __init__(self, backend=None, model_name: str = "all-MiniLM-L6-v2", threshold: float = 0.92):
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._np = np
+        self.backend = backend if backend is not None else MemoryCache()
+        self.model = SentenceTransformer(model_name)
+        self.threshold = threshold
+        # scope -> (向量矩阵, 结果列表)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str):
+        return self.model.encode([text], normalize_embeddings=True).astype(self._np.float32)
+
+    def _fits(self, text: str) -> bool:
+        """输入是否完整落在向量模型的可见长度内"""
+        return len(self.model.tokenizer(text)["input_ids"]) <= self.model.max_seq_length
+
+    def get(self, key: str, user_prompt: str = None, scope: str = None) -> Optional[str]:
+        value = self.backend.get(key, user_prompt, scope)
+        if value is not None or user_prompt is None or scope is None:
+            return value
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is None or not self._fits(user_prompt):
+                return None
+            embeddings, values = entry
+            scores = embeddings @ self._embed(user_prompt)[0]
+            best = int(scores.argmax())
+            if scores[best] > self.threshold:
+                return values[best]
+        return None
+
+    def set(self, key: str, value: str, user_prompt: str = None, scope: str = None) -> None:
+        self.backend.set(key, value, user_prompt, scope)
+        if user_prompt is None or scope is None:
+            return
+        with self._lock:
+            if not self._fits(user_prompt):
+                return
+            embedding = self._embed(user_prompt)
+            entry = self._entries.get(scope)
+            if entry is None:
+                self._entries[scope] = (embedding, [value])
+            else:
+                embeddings, values = entry
+                values.append(value)
+                self._entries[scope] = (self._np.vstack([embeddings, embedding]), values)
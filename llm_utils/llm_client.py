@@ -1,10 +1,98 @@
 import os
-from openai import OpenAI
+import time
+import logging
+import random
+import asyncio
+import threading
+import weakref
+import uuid
+import httpx
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    RateLimitError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+)
 
 from dotenv import load_dotenv
 
+from llm_utils.llm_cache import make_prefix_digest, make_cache_key, is_cacheable
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# SDK 与 HTTP 库的逐请求日志在高并发批处理中只会带来额外开销，只保留警告及以上
+for _name in ("openai", "httpx", "httpcore"):
+    logging.getLogger(_name).setLevel(logging.WARNING)
+
+# 连接池参数：批量处理时复用 TCP/TLS 连接，避免每个请求重新握手
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128, keepalive_expiry=30.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# 同步 HTTP 客户端按 (api_key, base_url) 在所有 LLMClient 之间共享并做引用计数，
+# 最后一个使用者调用 close() 时才真正关闭。
+# 异步客户端的连接绑定在创建它的事件循环上，因此不跨实例共享。
+_HTTP_POOLS = {}
+_HTTP_POOLS_LOCK = threading.Lock()
+
+# LLMClient.shared() 返回的单例，按可哈希的配置区分
+_SHARED_CLIENTS = {}
+_SHARED_CLIENTS_LOCK = threading.Lock()
+
+# shared() 中区分“未传入 cache”与“显式传入 None”
+_UNSET = object()
+
+
+def _acquire_http_pool(key) -> httpx.Client:
+    """获取 key 对应的共享同步 HTTP 客户端并增加引用计数，不存在或已关闭时新建"""
+    with _HTTP_POOLS_LOCK:
+        entry = _HTTP_POOLS.get(key)
+        if entry is None or entry[0].is_closed:
+            entry = [httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT), 0]
+            _HTTP_POOLS[key] = entry
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_http_pool(key, client: httpx.Client):
+    """减少共享同步 HTTP 客户端的引用计数，归零时关闭并移除"""
+    with _HTTP_POOLS_LOCK:
+        entry = _HTTP_POOLS.get(key)
+        if entry is None or entry[0] is not client:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _HTTP_POOLS[key]
+            client.close()
+
+# 系统提示词超过该字符数时才显式标记缓存，过短的前缀达不到服务端的最小缓存长度
+PROMPT_CACHE_MIN_CHARS = 1024
+
+# 只有这些错误值得重试（限流、网络、超时、5xx），其余错误直接抛出
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# 流式响应读到一半时连接中断（RemoteProtocolError、ReadError 等）不会被 SDK 包装成
+# APIConnectionError，而是直接抛出 httpx 的异常，因此流式请求额外重试这类错误
+STREAM_RETRYABLE_ERRORS = RETRYABLE_ERRORS + (httpx.TransportError,)
+
+
+def _next_retry_delay(error: Exception, prev_delay: float, base: float, cap: float) -> float:
+    """
+    计算下一次重试前的等待秒数：优先遵循服务端的 retry-after，
+    否则使用 decorrelated jitter 指数退避 min(cap, uniform(base, prev_delay * 3))。
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return min(cap, random.uniform(base, max(base, prev_delay) * 3))
+
 class LLMClient:
     """
     一个用于调用大语言模型的通用客户端类。
@@ -32,7 +120,13 @@ class LLMClient:
         model_name: str = None,
         api_key: str = None,
         base_url: str = None,
-        system_prompt: str = None
+        system_prompt: str = None,
+        http_client: httpx.Client = None,
+        async_http_client: httpx.AsyncClient = None,
+        cache=None,
+        rpm: int = None,
+        tpm: int = None,
+        prompt_cache: bool = None
     ):
         """
         初始化 LLM 客户端。
@@ -41,6 +135,18 @@ class LLMClient:
             api_key (str, optional): 对应服务商的 API Key. 若未传入则自动从环境变量读取。
             base_url (str, optional): OpenAI 兼容 API 的 Base URL. 若未传入则自动从环境变量读取。
             system_prompt (str, optional): 系统提示词。未传入时自动从环境变量读取或用默认。
+            http_client (httpx.Client, optional): 同步 HTTP 客户端。未传入时使用按 (api_key, base_url) 共享的连接池。
+            async_http_client (httpx.AsyncClient, optional): 共享的异步 HTTP 客户端。未传入时按 HTTP_LIMITS 新建。
+            cache (CacheBackend, optional): 响应缓存（见 llm_utils/llm_cache.py），仅对显式指定了低 temperature 的调用生效。
+            rpm (int, optional): acall 每分钟最大请求数，未传入时不限速。需要 aiolimiter。
+            tpm (int, optional): acall 每分钟最大 token 数，未传入时不限速。需要 aiolimiter。
+            prompt_cache (bool, optional): 是否给较长的系统提示词加上 Anthropic 风格的
+                cache_control 标记。未传入时根据 base_url 是否包含 "anthropic" 自动判断。
+
+        关于提示词缓存:
+            同一个客户端的所有请求都以完全相同的系统消息开头（不注入时间戳等可变内容），
+            因此 OpenAI 会对超过 1024 token 的前缀自动做 prompt caching；
+            对 Anthropic 兼容接口，则需要开启 prompt_cache 显式标记系统提示词。
         """
         self.model_name = model_name or os.environ.get("MODEL_NAME")
         self.api_key = api_key or os.environ.get("API_KEY")
@@ -55,8 +161,31 @@ class LLMClient:
             or os.environ.get("DEFAULT_SYSTEM_PROMPT")
             or "You are a helpful assistant."
         )
+        if prompt_cache is None:
+            prompt_cache = "anthropic" in (self.base_url or "")
+        self.prompt_cache = prompt_cache
+        self._system_msg = self._build_system_msg(self.system_prompt)
+        self._cache_prefix = make_prefix_digest(self.model_name, self.system_prompt, self.base_url)
+
+        # 外部传入的 HTTP 客户端由调用方负责关闭
+        self._owns_http = http_client is None
+        self._owns_ahttp = async_http_client is None
+        self._http = http_client
+        self._ahttp = async_http_client
+
+        self.cache = cache
+
+        # 令牌桶限速，按 API 的真实配额放行请求。
+        # AsyncLimiter 不能跨事件循环复用，因此按事件循环分别创建（见 _get_limiters）
+        self.rpm = rpm
+        self.tpm = tpm
+        self._limiters = weakref.WeakKeyDictionary()
+        if rpm or tpm:
+            # 尽早暴露缺少依赖的问题
+            import aiolimiter  # noqa: F401
 
         self.client = None
+        self.aclient = None
         self._initialize_client()
 
     def _initialize_client(self):
@@ -64,12 +193,87 @@ class LLMClient:
         if not self.api_key:
             raise ValueError(f"未找到 API Key，请检查环境变量或传入参数")
         
+        if self._http is None:
+            self._http = _acquire_http_pool((self.api_key, self.base_url))
+
         # 统一使用 OpenAI 客户端
         self.client = OpenAI(
             api_key=self.api_key, 
-            base_url=self.base_url
+            base_url=self.base_url,
+            http_client=self._http,
+            max_retries=0
+        )
+        self._initialize_async_client()
+
+    def _initialize_async_client(self):
+        """初始化异步客户端，供批量并发调用使用"""
+        if self._ahttp is None or (self._owns_ahttp and self._ahttp.is_closed):
+            self._ahttp = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        self.aclient = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self._ahttp,
+            max_retries=0
         )
 
+    @classmethod
+    def shared(
+        cls,
+        model_name: str = None,
+        api_key: str = None,
+        base_url: str = None,
+        system_prompt: str = None,
+        rpm: int = None,
+        tpm: int = None,
+        prompt_cache: bool = None,
+        cache=_UNSET
+    ) -> "LLMClient":
+        """
+        获取进程内共享的 LLMClient 单例（线程安全），相同配置总是返回同一个实例。
+
+        注意: 共享实例上调用 set_system_prompt、替换 cache 或调用 aclose 都会影响所有使用者；
+        需要独立缓存或生命周期的场景（如 folder_processor 的单次运行）应直接构造 LLMClient，
+        同步连接池仍会按 (api_key, base_url) 共享。
+
+        参数:
+            cache (CacheBackend, optional): 不参与区分实例；显式传入时（包括 None）
+                会替换共享实例当前使用的缓存。
+            其余参数同 LLMClient 的构造参数。
+        """
+        key = (model_name, api_key, base_url, system_prompt, rpm, tpm, prompt_cache)
+        with _SHARED_CLIENTS_LOCK:
+            client = _SHARED_CLIENTS.get(key)
+            if client is None:
+                client = cls(
+                    model_name=model_name,
+                    api_key=api_key,
+                    base_url=base_url,
+                    system_prompt=system_prompt,
+                    rpm=rpm,
+                    tpm=tpm,
+                    prompt_cache=prompt_cache
+                )
+                _SHARED_CLIENTS[key] = client
+            if cache is not _UNSET:
+                client.cache = cache
+            return client
+
+    def close(self):
+        """
+        释放同步 HTTP 连接池。共享连接池采用引用计数，只有最后一个使用者释放时才真正关闭；
+        外部传入的 http_client 由调用方自行关闭。
+        """
+        if self._http is None:
+            return
+        if self._owns_http:
+            _release_http_pool((self.api_key, self.base_url), self._http)
+        self._http = None
+
+    async def aclose(self):
+        """关闭自建的异步 HTTP 连接池；之后再次调用 acall 会自动重建"""
+        if self._owns_ahttp and self._ahttp is not None:
+            await self._ahttp.aclose()
+
     def set_system_prompt(self, prompt: str):
         """
         设置一个系统级的提示词(System Prompt)。
@@ -78,16 +282,144 @@ class LLMClient:
             prompt (str): 你希望模型扮演的角色或遵循的规则。
         """
         self.system_prompt = prompt
-        print(f"System prompt 已设置为: '{prompt}'")
+        self._system_msg = self._build_system_msg(prompt)
+        self._cache_prefix = make_prefix_digest(self.model_name, prompt, self.base_url)
+        logger.info(f"System prompt 已设置为: '{prompt}'")
+
+    def _build_system_msg(self, prompt: str):
+        """构建系统消息；需要时把长提示词标记为可缓存的前缀"""
+        if not prompt:
+            return None
+        if self.prompt_cache and len(prompt) > PROMPT_CACHE_MIN_CHARS:
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+            }
+        return {"role": "system", "content": prompt}
+
+    def _estimate_tokens(self, messages: list) -> int:
+        """粗略估算请求消耗的 token 数（约4字符/token），用于 TPM 预扣"""
+        chars = 0
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                chars += len(content)
+            else:
+                chars += sum(len(part.get("text", "")) for part in content)
+        return min(max(1, chars // 4), self.tpm)
+
+    def _get_limiters(self):
+        """返回当前事件循环对应的 (rpm_limiter, tpm_limiter)，未设置限速的一项为 None"""
+        if not (self.rpm or self.tpm):
+            return None, None
+        loop = asyncio.get_running_loop()
+        limiters = self._limiters.get(loop)
+        if limiters is None:
+            from aiolimiter import AsyncLimiter
+            limiters = (
+                AsyncLimiter(self.rpm, 60) if self.rpm else None,
+                AsyncLimiter(self.tpm, 60) if self.tpm else None,
+            )
+            self._limiters[loop] = limiters
+        return limiters
+
+    async def _acquire_limits(self, messages: list) -> int:
+        """按 RPM/TPM 限速等待配额，返回预扣的 token 数"""
+        rpm_limiter, tpm_limiter = self._get_limiters()
+        if rpm_limiter is not None:
+            await rpm_limiter.acquire()
+        estimated = 0
+        if tpm_limiter is not None:
+            estimated = self._estimate_tokens(messages)
+            await tpm_limiter.acquire(estimated)
+        return estimated
+
+    async def _correct_usage(self, usage, estimated: int):
+        """用实际消耗修正预扣的 token 数"""
+        _, tpm_limiter = self._get_limiters()
+        if tpm_limiter is not None and usage is not None and usage.total_tokens > estimated:
+            await tpm_limiter.acquire(min(usage.total_tokens - estimated, self.tpm))
+
+    def _get_aclient(self):
+        """返回可用的异步客户端；自建连接池被 aclose 关闭后自动重建"""
+        if self._owns_ahttp and self._ahttp.is_closed:
+            self._initialize_async_client()
+        return self.aclient
+
+    async def _acreate(self, messages: list, **kwargs):
+        """在 RPM/TPM 限速下发起一次异步 chat completions 请求"""
+        estimated = await self._acquire_limits(messages)
+        response = await self._get_aclient().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            **kwargs
+        )
+        await self._correct_usage(getattr(response, "usage", None), estimated)
+        return response
+
+    def _build_messages(self, user_prompt: str) -> list:
+        """构建消息列表（重试时复用）"""
+        return ([self._system_msg] if self._system_msg else []) + [{"role": "user", "content": user_prompt}]
+
+    def _retry(self, attempt_fn, max_retries: int, retry_delay: float, max_retry_delay: float):
+        """
+        同步重试：遇到 RETRYABLE_ERRORS 时按指数退避重试 attempt_fn，
+        其他错误直接抛出；重试次数用尽后抛出最后一次的错误。
+        """
+        delay = retry_delay
+        for attempt in range(1, max_retries + 1):
+            try:
+                return attempt_fn()
+            except RETRYABLE_ERRORS as e:
+                logger.warning(f"调用 API 时出错（第{attempt}次）: {e}")
+                if attempt >= max_retries:
+                    raise
+                delay = _next_retry_delay(e, delay, retry_delay, max_retry_delay)
+                time.sleep(delay)
 
-    def call(self, user_prompt: str, max_retries: int = 3, retry_delay: float = 1.0, **kwargs) -> str:
+    async def _aretry(
+        self,
+        attempt_fn,
+        max_retries: int,
+        retry_delay: float,
+        max_retry_delay: float,
+        retryable: tuple = RETRYABLE_ERRORS
+    ):
+        """_retry 的异步版本，attempt_fn 为返回协程的函数；retryable 为需要重试的错误类型"""
+        delay = retry_delay
+        for attempt in range(1, max_retries + 1):
+            try:
+                return await attempt_fn()
+            except retryable as e:
+                logger.warning(f"调用 API 时出错（第{attempt}次）: {e}")
+                if attempt >= max_retries:
+                    raise
+                delay = _next_retry_delay(e, delay, retry_delay, max_retry_delay)
+                await asyncio.sleep(delay)
+
+    def _cache_key(self, user_prompt: str, kwargs: dict):
+        """返回本次调用的 CacheKey；不适合缓存时返回 None"""
+        if self.cache is None or not is_cacheable(kwargs):
+            return None
+        return make_cache_key(self._cache_prefix, user_prompt, kwargs)
+
+    def call(
+        self,
+        user_prompt: str,
+        max_retries: int = 6,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+        **kwargs
+    ) -> str:
         """
-        调用大模型并获取返回结果，支持出错自动重试。
+        调用大模型并获取返回结果，遇到限流、网络、超时和 5xx 错误时按指数退避自动重试，
+        其他错误直接抛出。
 
         参数:
             user_prompt (str): 用户输入的问题或指令。
-            max_retries (int): 最大重试次数，默认3次。
-            retry_delay (float): 每次重试间隔秒数，默认2秒。
+            max_retries (int): 最大尝试次数，默认6次。
+            retry_delay (float): 退避的基础等待秒数，默认1秒。
+            max_retry_delay (float): 单次等待的上限秒数，默认60秒。
             **kwargs: 传递给底层 API 的其他参数 (e.g., temperature, max_tokens)。
 
         返回:
@@ -95,30 +427,171 @@ class LLMClient:
         """
         if not self.client:
             raise ConnectionError("客户端未初始化，请检查初始化参数。")
-        
-        last_exception = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                # 构建消息列表
-                messages = []
-                if self.system_prompt:
-                    messages.append({"role": "system", "content": self.system_prompt})
-                messages.append({"role": "user", "content": user_prompt})
-                
-                # 统一使用 OpenAI chat completions API
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    **kwargs
+
+        cache_key = self._cache_key(user_prompt, kwargs)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key.key, user_prompt, cache_key.scope)
+            if cached is not None:
+                return cached
+
+        messages = self._build_messages(user_prompt)
+
+        def _attempt():
+            # 统一使用 OpenAI chat completions API
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                **kwargs
+            )
+            return response.choices[0].message.content.strip()
+
+        try:
+            content = self._retry(_attempt, max_retries, retry_delay, max_retry_delay)
+        except RETRYABLE_ERRORS as e:
+            return f"Error after {max_retries} retries: {e}"
+        if cache_key is not None:
+            self.cache.set(cache_key.key, content, user_prompt, cache_key.scope)
+        return content
+
+    async def acall(
+        self,
+        user_prompt: str,
+        max_retries: int = 6,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+        **kwargs
+    ) -> str:
+        """
+        call 的异步版本，使用 AsyncOpenAI，适合配合 asyncio.gather 批量并发调用。
+
+        参数与返回值同 call。
+        """
+        if not self.aclient:
+            raise ConnectionError("客户端未初始化，请检查初始化参数。")
+
+        cache_key = self._cache_key(user_prompt, kwargs)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key.key, user_prompt, cache_key.scope)
+            if cached is not None:
+                return cached
+
+        messages = self._build_messages(user_prompt)
+
+        async def _attempt():
+            response = await self._acreate(messages, **kwargs)
+            return response.choices[0].message.content.strip()
+
+        try:
+            content = await self._aretry(_attempt, max_retries, retry_delay, max_retry_delay)
+        except RETRYABLE_ERRORS as e:
+            return f"Error after {max_retries} retries: {e}"
+        if cache_key is not None:
+            self.cache.set(cache_key.key, content, user_prompt, cache_key.scope)
+        return content
+
+    async def _astream_to_file(self, messages: list, path: str, collect: bool, **kwargs):
+        """
+        发起一次流式请求并把内容写入 path，返回 (写入字符数, 完整内容或 None)。
+        写入内容等价于完整响应 strip() 后的结果。
+        """
+        import aiofiles
+
+        # 设置了 TPM 时要求最后一个分片携带 usage，以便修正预扣；
+        # 未限速时不发送该参数，部分兼容接口会以 400 拒绝不认识的参数
+        if self.tpm:
+            kwargs["stream_options"] = {"include_usage": True, **(kwargs.get("stream_options") or {})}
+        estimated = await self._acquire_limits(messages)
+        stream = await self._get_aclient().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+            **kwargs
+        )
+        written = 0
+        usage = None
+        # 末尾的空白先暂存，遇到后续非空白内容再写出，等价于 strip()
+        pending = ""
+        # 只有需要写缓存时才保留完整内容
+        parts = [] if collect else None
+        async with stream:
+            async with aiofiles.open(path, "w", encoding="utf-8") as f:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if not written and not pending:
+                        delta = delta.lstrip()
+                    text = pending + delta
+                    body = text.rstrip()
+                    pending = text[len(body):]
+                    if body:
+                        await f.write(body)
+                        written += len(body)
+                        if parts is not None:
+                            parts.append(body)
+        await self._correct_usage(usage, estimated)
+        return written, ("".join(parts) if parts is not None else None)
+
+    async def acall_stream(
+        self,
+        user_prompt: str,
+        output_path,
+        max_retries: int = 6,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+        **kwargs
+    ) -> int:
+        """
+        以流式方式调用大模型，边生成边写入 output_path，内存占用与响应长度无关。
+        写入内容与 acall 的返回值一致（去除首尾空白）。需要 aiofiles。
+
+        内容先写入同目录下的临时文件，成功后再原子替换为 output_path，
+        失败时不会留下不完整的输出文件。
+
+        参数:
+            user_prompt (str): 用户输入的问题或指令。
+            output_path (str | Path): 输出文件路径，已存在时会被覆盖。
+            其余参数同 acall。
+
+        返回:
+            int: 写入的字符数。
+
+        异常:
+            重试次数用尽后抛出最后一次的错误，不会把错误信息写入文件。
+        """
+        import aiofiles
+
+        if not self.aclient:
+            raise ConnectionError("客户端未初始化，请检查初始化参数。")
+
+        output_path = str(output_path)
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+
+        cache_key = self._cache_key(user_prompt, kwargs)
+        messages = self._build_messages(user_prompt)
+
+        try:
+            cached = self.cache.get(cache_key.key, user_prompt, cache_key.scope) if cache_key is not None else None
+            if cached is not None:
+                async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+                    await f.write(cached)
+                written = len(cached)
+            else:
+                written, content = await self._aretry(
+                    lambda: self._astream_to_file(messages, tmp_path, cache_key is not None, **kwargs),
+                    max_retries, retry_delay, max_retry_delay, STREAM_RETRYABLE_ERRORS
                 )
-                return response.choices[0].message.content.strip()
-            except Exception as e:
-                print(f"调用 API 时出错（第{attempt}次）: {e}")
-                last_exception = e
-                if attempt < max_retries:
-                    import time
-                    time.sleep(retry_delay)
-        return f"Error after {max_retries} retries: {last_exception}"
+                if cache_key is not None:
+                    self.cache.set(cache_key.key, content, user_prompt, cache_key.scope)
+            os.replace(tmp_path, output_path)
+            return written
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     def get_available_models(self):
         """
@@ -131,7 +604,7 @@ class LLMClient:
             models = self.client.models.list()
             return [model.id for model in models.data]
         except Exception as e:
-            print(f"获取模型列表时出错: {e}")
+            logger.error(f"获取模型列表时出错: {e}")
             return []
 
     def __str__(self):
@@ -139,12 +612,3 @@ class LLMClient:
 
     def __repr__(self):
         return self.__str__()
-    
-# test 
-# test_client = LLMClient()
-# print(test_client.api_key)
-# print(test_client.base_url)
-# print(test_client.model_name)
-
-# test_output = test_client.call("Hello, how are you?", max_retries=1, retry_delay=0.5)
-# print(test_output)
\ No newline at end of file
@@ -1,50 +1,116 @@
 import sys
 import os
 from pathlib import Path
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
-from queue import Queue
+import asyncio
+import json
+import mmap
 import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import logging
+import multiprocessing
+import aiofiles
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 添加项目路径到sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from llm_utils.llm_client import LLMClient
+from llm_utils.llm_cache import SqliteCache
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(threadName)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+def _run(coro):
+    """运行协程；安装了 uvloop 时使用 uvloop 事件循环以降低调度和 I/O 开销"""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    if not hasattr(uvloop, "run"):
+        # uvloop < 0.18 没有 uvloop.run，改为安装事件循环策略
+        uvloop.install()
+        return asyncio.run(coro)
+    return uvloop.run(coro)
+
+def _json_dumps(obj):
+    """序列化为 UTF-8 JSON 字节串；安装了 orjson 时用 orjson 加速"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _json_loads(data):
+    """解析 JSON（str 或 bytes）；安装了 orjson 时用 orjson 加速"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _classify_files(input_folder):
+    """
+    用 os.walk 单次遍历输入文件夹，把文件分为markdown文件和其他文件
+    
+    Args:
+        input_folder (Path): 输入文件夹路径
+    
+    Returns:
+        tuple: (markdown文件列表, 其他文件列表)
+    """
+    markdown_files = []
+    other_files = []
+    for dirpath, _, names in os.walk(input_folder):
+        for name in names:
+            file_path = Path(dirpath) / name
+            (markdown_files if name.endswith(".md") else other_files).append(file_path)
+    return markdown_files, other_files
+
+# 复制是 I/O 密集型任务，线程数可以明显多于 CPU 核数
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-def copy_non_markdown_files(input_folder, output_folder):
+def _copy_one(file_path, input_folder, output_folder, preserve_metadata=True):
+    """复制单个文件，保持相对路径"""
+    output_file_path = output_folder / file_path.relative_to(input_folder)
+    output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    # copyfile 在 Linux 上走 sendfile 零拷贝；copy2 额外复制权限和时间戳
+    if preserve_metadata:
+        shutil.copy2(file_path, output_file_path)
+    else:
+        shutil.copyfile(file_path, output_file_path)
+
+def copy_non_markdown_files(input_folder, output_folder, files=None, preserve_metadata=True):
     """
-    复制所有非markdown文件到输出文件夹，保持文件夹结构
+    复制所有非markdown文件到输出文件夹，保持文件夹结构（多线程并行复制）
     
     Args:
         input_folder (Path): 输入文件夹路径
         output_folder (Path): 输出文件夹路径
+        files (list, optional): 需要复制的文件列表，默认扫描输入文件夹中的所有非markdown文件
+        preserve_metadata (bool, optional): 是否保留权限和时间戳，关闭后可省去每个文件的 stat/chmod/utime，默认保留
     
     Returns:
         dict: 复制结果统计
     """
+    if files is None:
+        _, files = _classify_files(input_folder)
+    
     copied_files = []
     failed_files = []
     
-    print("正在复制非markdown文件...")
+    logger.info("正在复制非markdown文件...")
     
-    # 遍历所有文件
-    for file_path in input_folder.rglob("*"):
-        if file_path.is_file() and not file_path.name.endswith('.md'):
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        future_to_file = {
+            executor.submit(_copy_one, file_path, input_folder, output_folder, preserve_metadata): file_path
+            for file_path in files
+        }
+        for future in as_completed(future_to_file):
+            file_path = future_to_file[future]
             try:
-                # 计算相对路径，保持文件夹结构
-                relative_path = file_path.relative_to(input_folder)
-                output_file_path = output_folder / relative_path
-                
-                # 创建输出目录（如果不存在）
-                output_file_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # 复制文件
-                shutil.copy2(file_path, output_file_path)
+                future.result()
                 copied_files.append(str(file_path))
-                
             except Exception as e:
-                error_msg = f"复制文件 {file_path} 时出错: {e}"
-                print(error_msg)
+                logger.error(f"复制文件 {file_path} 时出错: {e}")
                 failed_files.append({"file": str(file_path), "error": str(e)})
     
     result = {
@@ -54,80 +120,115 @@ def copy_non_markdown_files(input_folder, output_folder):
         "failed_files": failed_files
     }
     
-    print(f"复制完成：成功复制 {result['copied_count']} 个非markdown文件，失败 {result['failed_count']} 个")
+    logger.info(f"复制完成：成功复制 {result['copied_count']} 个非markdown文件，失败 {result['failed_count']} 个")
     
     return result
 
-def process_single_file(file_info, llm_client, input_folder, output_folder, progress_queue):
+def _read_markdown(file_path):
     """
-    处理单个文件的函数
+    以二进制方式读取markdown文件并一次性按UTF-8解码；
+    大于一页的文件通过 mmap 映射读取，避免文本模式解码器的分块开销
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < mmap.PAGESIZE:
+            return f.read().decode("utf-8")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:].decode("utf-8")
+
+async def _write_output(output_folder, relative_path, content):
+    """把处理结果写到输出文件夹中对应的相对路径"""
+    output_file_path = output_folder / relative_path
+    output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    async with aiofiles.open(output_file_path, "w", encoding="utf-8") as f:
+        await f.write(content)
+    return output_file_path
+
+async def process_single_file(file_info, llm_client, input_folder, output_folder):
+    """
+    处理单个文件的协程
     
     Args:
         file_info (tuple): (文件索引, 文件路径, 总文件数)
         llm_client (LLMClient): LLM客户端实例
         input_folder (Path): 输入文件夹路径
         output_folder (Path): 输出文件夹路径
-        progress_queue (Queue): 用于进度报告的队列
     
     Returns:
         dict: 处理结果
     """
     i, file_path, total_files = file_info
-    thread_id = threading.current_thread().ident
     
     try:
-        progress_queue.put(f"[线程{thread_id}] [{i}/{total_files}] 正在处理: {file_path}")
+        logger.info(f"[{i}/{total_files}] 正在处理: {file_path}")
         
         # 读取文件内容
-        with open(file_path, "r", encoding="utf-8") as f:
-            article = f.read()
-        
-        # 使用LLM处理文件
-        response = llm_client.call(article, temperature=0.01)
+        article = await asyncio.to_thread(_read_markdown, file_path)
         
         # 计算相对路径，保持文件夹结构
-        relative_path = file_path.relative_to(input_folder)
-        output_file_path = output_folder / relative_path
-        
-        # 创建输出目录（如果不存在）
+        output_file_path = output_folder / file_path.relative_to(input_folder)
         output_file_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 写入处理后的内容
-        with open(output_file_path, "w", encoding="utf-8") as f:
-            f.write(response)
+        # 使用LLM处理文件，生成内容边收边写入输出文件
+        await llm_client.acall_stream(article, output_file_path, temperature=0.01)
         
-        progress_queue.put(f"[线程{thread_id}] 处理完成: {output_file_path}")
+        logger.info(f"[{i}/{total_files}] 处理完成: {output_file_path}")
         
         return {
             "success": True,
             "file": str(file_path),
-            "output": str(output_file_path),
-            "thread_id": thread_id
+            "output": str(output_file_path)
         }
         
     except Exception as e:
-        error_msg = f"[线程{thread_id}] 处理文件 {file_path} 时出错: {e}"
-        progress_queue.put(error_msg)
+        logger.error(f"[{i}/{total_files}] 处理文件 {file_path} 时出错: {e}")
         return {
             "success": False,
             "file": str(file_path),
-            "error": str(e),
-            "thread_id": thread_id
+            "error": str(e)
         }
 
-def process_folder(input_folder_path, output_folder_path, prompt_file_path=None, max_workers=30, rate_limit_delay=0.5):
+async def _aprocess_files(markdown_files, llm_client, input_folder, output_folder, max_workers):
     """
-    批量处理文件夹中的所有markdown文件（多线程版本），同时复制所有其他文件
+    并发处理一组markdown文件，用信号量限制同时在途的请求数
+    
+    Returns:
+        tuple: (成功文件列表, 失败文件列表)
+    """
+    file_infos = [(i+1, file_path, len(markdown_files)) for i, file_path in enumerate(markdown_files)]
+    sem = asyncio.Semaphore(max_workers)
+    
+    async def _one(file_info):
+        async with sem:
+            return await process_single_file(file_info, llm_client, input_folder, output_folder)
+    
+    results = await asyncio.gather(*[_one(file_info) for file_info in file_infos], return_exceptions=True)
+    
+    successful_files = []
+    failed_files = []
+    for file_info, result in zip(file_infos, results):
+        if isinstance(result, BaseException):
+            logger.error(f"任务执行异常 {file_info[1]}: {result}")
+            failed_files.append({"file": str(file_info[1]), "error": str(result)})
+        elif result["success"]:
+            successful_files.append(result["file"])
+        else:
+            failed_files.append({"file": result["file"], "error": result["error"]})
+    return successful_files, failed_files
+
+def _prepare_run(input_folder_path, output_folder_path, prompt_file_path=None, preserve_metadata=True):
+    """
+    各入口共用的准备工作：确定prompt文件路径、检查输入文件夹、创建输出文件夹、
+    单次遍历区分markdown文件和其他文件、复制其他文件并读取prompt
     
     Args:
         input_folder_path (str): 输入文件夹路径
         output_folder_path (str): 输出文件夹路径
         prompt_file_path (str, optional): prompt文件路径，默认使用edit_prompt.yaml
-        max_workers (int, optional): 最大并发线程数，默认为4
-        rate_limit_delay (float, optional): API调用间隔（秒），默认0.5秒
+        preserve_metadata (bool, optional): 复制非markdown文件时是否保留权限和时间戳，默认保留
     
     Returns:
-        dict: 包含处理结果的字典
+        dict: 出错时为 {"error": ...}；否则包含 input_folder、output_folder、
+            markdown_files、copy_result 和 prompt
     """
     
     # 设置默认prompt文件路径
@@ -147,8 +248,11 @@ def process_folder(input_folder_path, output_folder_path, prompt_file_path=None,
     # 创建输出文件夹
     output_folder.mkdir(parents=True, exist_ok=True)
     
+    # 单次遍历输入文件夹，区分markdown文件和其他文件
+    markdown_files, other_files = _classify_files(input_folder)
+    
     # 首先复制所有非markdown文件
-    copy_result = copy_non_markdown_files(input_folder, output_folder)
+    copy_result = copy_non_markdown_files(input_folder, output_folder, other_files, preserve_metadata)
     
     # 读取prompt文件
     try:
@@ -157,107 +261,311 @@ def process_folder(input_folder_path, output_folder_path, prompt_file_path=None,
     except Exception as e:
         return {"error": f"无法读取prompt文件 {prompt_file_path}: {e}"}
     
-    # 初始化LLM客户端
-    llm_client = LLMClient(system_prompt=prompt)
+    if markdown_files:
+        logger.info(f"找到 {len(markdown_files)} 个markdown文件")
+    else:
+        logger.info(f"在 {input_folder} 中没有找到markdown文件")
     
-    # 获取所有markdown文件
-    markdown_files = []
-    for file_path in input_folder.rglob("*.md"):
-        if file_path.is_file():
-            markdown_files.append(file_path)
+    return {
+        "input_folder": input_folder,
+        "output_folder": output_folder,
+        "markdown_files": markdown_files,
+        "copy_result": copy_result,
+        "prompt": prompt
+    }
+
+def _summarize(run, successful_files, failed_files, **extra):
+    """
+    汇总处理结果并打印统计信息（即使没有markdown文件，也返回复制结果）
     
-    if not markdown_files:
-        print(f"在 {input_folder} 中没有找到markdown文件")
-        # 即使没有markdown文件，也返回复制结果
-        return {
-            "total_files": 0,
-            "successful_count": 0,
-            "failed_count": 0,
-            "successful_files": [],
-            "failed_files": [],
-            "output_folder": str(output_folder),
-            "max_workers": max_workers,
-            "copy_result": copy_result
-        }
+    Args:
+        run (dict): _prepare_run 的返回值
+        successful_files (list): 成功处理的文件列表
+        failed_files (list): 处理失败的文件列表
+        **extra: 各入口特有的结果字段，如 max_workers、batch_id、processes
     
-    print(f"找到 {len(markdown_files)} 个markdown文件")
-    print(f"使用 {max_workers} 个线程并行处理")
+    Returns:
+        dict: 包含处理结果的字典
+    """
+    copy_result = run["copy_result"]
+    result = {
+        "total_files": len(run["markdown_files"]),
+        "successful_count": len(successful_files),
+        "failed_count": len(failed_files),
+        "successful_files": successful_files,
+        "failed_files": failed_files,
+        "output_folder": str(run["output_folder"]),
+        **extra,
+        "copy_result": copy_result
+    }
     
-    # 创建进度报告队列
-    progress_queue = Queue()
+    logger.info("处理完成！")
+    logger.info(f"成功处理markdown文件: {result['successful_count']} 个")
+    logger.info(f"处理失败markdown文件: {result['failed_count']} 个")
+    logger.info(f"成功复制其他文件: {copy_result['copied_count']} 个")
+    logger.info(f"复制失败其他文件: {copy_result['failed_count']} 个")
+    logger.info(f"输出文件夹: {result['output_folder']}")
     
-    # 准备文件信息
-    file_infos = [(i+1, file_path, len(markdown_files)) for i, file_path in enumerate(markdown_files)]
+    return result
+
+async def aprocess_folder(input_folder_path, output_folder_path, prompt_file_path=None, max_workers=30, *, cache_path=None, rpm=None, tpm=None, preserve_metadata=True):
+    """
+    批量处理文件夹中的所有markdown文件（asyncio版本），同时复制所有其他文件。
+    cache_path 及之后的参数只能以关键字形式传入，避免旧代码按位置传入的 rate_limit_delay 被误当成缓存路径。
+    
+    Args:
+        input_folder_path (str): 输入文件夹路径
+        output_folder_path (str): 输出文件夹路径
+        prompt_file_path (str, optional): prompt文件路径，默认使用edit_prompt.yaml
+        max_workers (int, optional): 最大并发请求数，默认为30
+        cache_path (str, optional): sqlite 响应缓存路径，重复运行时相同输入直接复用结果，默认不缓存
+        rpm (int, optional): 每分钟最大请求数，默认不限速
+        tpm (int, optional): 每分钟最大 token 数，默认不限速
+        preserve_metadata (bool, optional): 复制非markdown文件时是否保留权限和时间戳，默认保留
+    
+    Returns:
+        dict: 包含处理结果的字典
+    """
+    # 遍历和复制放到线程中，避免阻塞事件循环
+    run = await asyncio.to_thread(_prepare_run, input_folder_path, output_folder_path, prompt_file_path, preserve_metadata)
+    if "error" in run:
+        return run
     
-    # 处理结果
     successful_files = []
     failed_files = []
     
-    # 使用线程池执行器
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有任务
-        future_to_file = {
-            executor.submit(process_single_file, file_info, llm_client, input_folder, output_folder, progress_queue): file_info
-            for file_info in file_infos
-        }
+    if run["markdown_files"]:
+        logger.info(f"最多同时发起 {max_workers} 个请求")
+        
+        # 每次运行使用自己的 LLMClient（缓存、限速、异步连接池互不干扰），
+        # 同步连接池仍按 (api_key, base_url) 在各实例间共享
+        cache = SqliteCache(cache_path) if cache_path else None
+        llm_client = LLMClient(system_prompt=run["prompt"], cache=cache, rpm=rpm, tpm=tpm)
         
-        # 监控进度和结果
-        completed_count = 0
-        for future in as_completed(future_to_file):
-            # 处理进度消息
-            while not progress_queue.empty():
-                try:
-                    message = progress_queue.get_nowait()
-                    print(message)
-                except:
-                    break
-            
-            # 获取结果
-            try:
-                result = future.result()
-                completed_count += 1
-                
-                if result["success"]:
-                    successful_files.append(result["file"])
-                else:
-                    failed_files.append({"file": result["file"], "error": result["error"]})
-                
-                # API调用速率限制
-                if rate_limit_delay > 0:
-                    time.sleep(rate_limit_delay)
-                    
-            except Exception as e:
-                file_info = future_to_file[future]
-                error_msg = f"线程执行异常 {file_info[1]}: {e}"
-                print(error_msg)
-                failed_files.append({"file": str(file_info[1]), "error": str(e)})
-                completed_count += 1
-    
-    # 处理剩余的进度消息
-    while not progress_queue.empty():
         try:
-            message = progress_queue.get_nowait()
-            print(message)
-        except:
-            break
+            successful_files, failed_files = await _aprocess_files(
+                run["markdown_files"], llm_client, run["input_folder"], run["output_folder"], max_workers
+            )
+        finally:
+            await llm_client.aclose()
+            llm_client.close()
+            if cache is not None:
+                cache.close()
     
-    result = {
-        "total_files": len(markdown_files),
-        "successful_count": len(successful_files),
-        "failed_count": len(failed_files),
-        "successful_files": successful_files,
-        "failed_files": failed_files,
-        "output_folder": str(output_folder),
-        "max_workers": max_workers,
-        "copy_result": copy_result
-    }
+    return _summarize(run, successful_files, failed_files, max_workers=max_workers)
+
+def process_folder(input_folder_path, output_folder_path, prompt_file_path=None, max_workers=30, *, cache_path=None, rpm=None, tpm=None, preserve_metadata=True):
+    """
+    aprocess_folder 的同步封装，参数与返回值相同
+    """
+    return _run(aprocess_folder(
+        input_folder_path, output_folder_path, prompt_file_path, max_workers,
+        cache_path=cache_path, rpm=rpm, tpm=tpm, preserve_metadata=preserve_metadata
+    ))
+
+async def aprocess_folder_batch(input_folder_path, output_folder_path, prompt_file_path=None, max_workers=30, poll_interval=30.0, preserve_metadata=True):
+    """
+    使用 OpenAI Batch API 批量处理文件夹中的所有markdown文件，同时复制所有其他文件。
+    所有请求打包成一个 JSONL 文件上传，轮询任务直到结束后按 custom_id 写回结果；
+    Batch 中失败或缺失的文件再用 acall 逐个补跑。适合不要求实时返回的大批量处理。
     
-    print(f"\n处理完成！")
-    print(f"成功处理markdown文件: {result['successful_count']} 个")
-    print(f"处理失败markdown文件: {result['failed_count']} 个") 
-    print(f"成功复制其他文件: {copy_result['copied_count']} 个")
-    print(f"复制失败其他文件: {copy_result['failed_count']} 个")
-    print(f"输出文件夹: {result['output_folder']}")
-    print(f"使用了 {max_workers} 个线程")
+    Args:
+        input_folder_path (str): 输入文件夹路径
+        output_folder_path (str): 输出文件夹路径
+        prompt_file_path (str, optional): prompt文件路径，默认使用edit_prompt.yaml
+        max_workers (int, optional): 补跑失败文件时的最大并发请求数，默认为30
+        poll_interval (float, optional): 轮询 Batch 状态的间隔（秒），默认30秒
+        preserve_metadata (bool, optional): 复制非markdown文件时是否保留权限和时间戳，默认保留
     
-    return result
+    Returns:
+        dict: 包含处理结果的字典
+    """
+    run = await asyncio.to_thread(_prepare_run, input_folder_path, output_folder_path, prompt_file_path, preserve_metadata)
+    if "error" in run:
+        return run
+    
+    input_folder = run["input_folder"]
+    output_folder = run["output_folder"]
+    markdown_files = run["markdown_files"]
+    
+    successful_files = []
+    failed_files = []
+    batch_id = None
+    
+    if not markdown_files:
+        return _summarize(run, successful_files, failed_files, batch_id=batch_id)
+    
+    llm_client = LLMClient(system_prompt=run["prompt"])
+    files_by_id = {str(file_path.relative_to(input_folder)): file_path for file_path in markdown_files}
+    
+    # 构建 Batch 输入文件，每行一个 chat completions 请求
+    lines = []
+    for custom_id, file_path in files_by_id.items():
+        article = await asyncio.to_thread(_read_markdown, file_path)
+        lines.append(_json_dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": llm_client.model_name,
+                "messages": [
+                    {"role": "system", "content": llm_client.system_prompt},
+                    {"role": "user", "content": article}
+                ],
+                "temperature": 0.01
+            }
+        }))
+    batch_input = b"\n".join(lines) + b"\n"
+    
+    try:
+        logger.info("正在提交 Batch 任务...")
+        # 部分 OpenAI 兼容接口不支持 Batch API，提交失败时全部文件改走实时接口
+        try:
+            input_file = await llm_client.aclient.files.create(
+                file=("batch_input.jsonl", batch_input),
+                purpose="batch"
+            )
+            batch = await llm_client.aclient.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            batch_id = batch.id
+            logger.info(f"Batch 任务已提交: {batch_id}")
+        except Exception as e:
+            logger.error(f"提交 Batch 任务失败: {e}")
+            batch = None
+        
+        # 轮询直到任务进入终态
+        while batch is not None and batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(poll_interval)
+            batch = await llm_client.aclient.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts is not None:
+                logger.info(f"Batch {batch_id} 状态: {batch.status}（{counts.completed}/{counts.total}）")
+            else:
+                logger.info(f"Batch {batch_id} 状态: {batch.status}")
+        
+        # 过期或取消的任务也可能带有部分结果
+        if batch is not None and batch.output_file_id:
+            output = await llm_client.aclient.files.content(batch.output_file_id)
+            for line in output.content.splitlines():
+                if not line.strip():
+                    continue
+                # 单条结果异常时跳过，该文件留在 files_by_id 中交给下面的实时接口补跑
+                try:
+                    record = _json_loads(line)
+                    custom_id = record.get("custom_id")
+                    response = record.get("response") or {}
+                    if custom_id not in files_by_id or record.get("error") or response.get("status_code") != 200:
+                        continue
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    if not content:
+                        logger.warning(f"Batch 结果为空: {custom_id}")
+                        continue
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    logger.warning(f"无法解析 Batch 结果: {e}")
+                    continue
+                await _write_output(output_folder, custom_id, content.strip())
+                successful_files.append(str(files_by_id.pop(custom_id)))
+        
+        # Batch 中失败或缺失的文件逐个补跑
+        if files_by_id:
+            logger.info(f"Batch 未完成 {len(files_by_id)} 个文件，改用实时接口补跑")
+            retry_successful, retry_failed = await _aprocess_files(
+                list(files_by_id.values()), llm_client, input_folder, output_folder, max_workers
+            )
+            successful_files.extend(retry_successful)
+            failed_files.extend(retry_failed)
+    finally:
+        await llm_client.aclose()
+        llm_client.close()
+    
+    return _summarize(run, successful_files, failed_files, batch_id=batch_id)
+
+def process_folder_batch(input_folder_path, output_folder_path, prompt_file_path=None, max_workers=30, poll_interval=30.0, preserve_metadata=True):
+    """
+    aprocess_folder_batch 的同步封装，参数与返回值相同
+    """
+    return _run(aprocess_folder_batch(input_folder_path, output_folder_path, prompt_file_path, max_workers, poll_interval, preserve_metadata))
+
+def _split_evenly(total, parts):
+    """把 total 尽量平均地分成 parts 份，余数分给前几份"""
+    base, remainder = divmod(total, parts)
+    return [base + (1 if i < remainder else 0) for i in range(parts)]
+
+async def _aprocess_chunk(markdown_files, prompt, input_folder, output_folder, max_workers, rpm, tpm):
+    """子进程内的处理协程：用一个 LLMClient 并发处理一批文件"""
+    llm_client = LLMClient(system_prompt=prompt, rpm=rpm, tpm=tpm)
+    try:
+        return await _aprocess_files(markdown_files, llm_client, input_folder, output_folder, max_workers)
+    finally:
+        await llm_client.aclose()
+        llm_client.close()
+
+def _process_chunk(markdown_files, prompt, input_folder, output_folder, max_workers, rpm, tpm):
+    """ProcessPoolExecutor 的入口：每个子进程运行自己的事件循环"""
+    return _run(_aprocess_chunk(markdown_files, prompt, input_folder, output_folder, max_workers, rpm, tpm))
+
+def process_folder_multiprocess(input_folder_path, output_folder_path, prompt_file_path=None, processes=None, max_workers=30, rpm=None, tpm=None, preserve_metadata=True):
+    """
+    多进程 + asyncio 批量处理文件夹中的所有markdown文件，同时复制所有其他文件。
+    文件按进程数分片，每个子进程持有自己的 AsyncOpenAI 客户端并运行独立的事件循环，
+    读取、解码和 JSON 序列化等 CPU 开销因此可以利用多核。
+    
+    Args:
+        input_folder_path (str): 输入文件夹路径
+        output_folder_path (str): 输出文件夹路径
+        prompt_file_path (str, optional): prompt文件路径，默认使用edit_prompt.yaml
+        processes (int, optional): 子进程数，默认为CPU核数；不会超过文件数、max_workers 以及设置了的 rpm/tpm
+        max_workers (int, optional): 所有进程合计的最大并发请求数，默认为30
+        rpm (int, optional): 所有进程合计的每分钟最大请求数，默认不限速
+        tpm (int, optional): 所有进程合计的每分钟最大 token 数，默认不限速
+        preserve_metadata (bool, optional): 复制非markdown文件时是否保留权限和时间戳，默认保留
+    
+    Returns:
+        dict: 包含处理结果的字典
+    """
+    run = _prepare_run(input_folder_path, output_folder_path, prompt_file_path, preserve_metadata)
+    if "error" in run:
+        return run
+    
+    markdown_files = run["markdown_files"]
+    
+    # 每个进程至少要分到 1 个并发和 1 份限速配额，进程数不能超过这些总量
+    limits = [processes or os.cpu_count() or 1, len(markdown_files) or 1, max_workers]
+    limits += [limit for limit in (rpm, tpm) if limit]
+    processes = max(1, min(limits))
+    # 并发数和限速配额在各进程间分配，余数分给前几个进程，合计恰好等于总量
+    workers_shares = _split_evenly(max_workers, processes)
+    rpm_shares = _split_evenly(rpm, processes) if rpm else [None] * processes
+    tpm_shares = _split_evenly(tpm, processes) if tpm else [None] * processes
+    
+    successful_files = []
+    failed_files = []
+    
+    if markdown_files:
+        logger.info(f"使用 {processes} 个进程，合计最多同时发起 {max_workers} 个请求")
+        
+        chunks = [markdown_files[i::processes] for i in range(processes)]
+        # forkserver 让子进程从干净的服务进程派生，不继承父进程的事件循环和连接池
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as executor:
+            future_to_chunk = {
+                executor.submit(
+                    _process_chunk, chunk, run["prompt"], run["input_folder"], run["output_folder"],
+                    workers_share, rpm_share, tpm_share
+                ): chunk
+                for chunk, workers_share, rpm_share, tpm_share in zip(chunks, workers_shares, rpm_shares, tpm_shares)
+            }
+            for future in as_completed(future_to_chunk):
+                try:
+                    chunk_successful, chunk_failed = future.result()
+                    successful_files.extend(chunk_successful)
+                    failed_files.extend(chunk_failed)
+                except Exception as e:
+                    logger.error(f"子进程执行异常: {e}")
+                    failed_files.extend({"file": str(file_path), "error": str(e)} for file_path in future_to_chunk[future])
+    
+    return _summarize(run, successful_files, failed_files, processes=processes, max_workers=max_workers)